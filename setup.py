@@ -1,11 +1,13 @@
 from setuptools import setup, find_packages
 
+from youtube_music_control import __version__
+
 with open("README.md", "r") as f:
     long_description = f.read()
 
 setup(
     name="youtube-music-control",
-    version="0.1.0",
+    version=__version__,
     description="Remote control client for th-ch/youtube-music",
     long_description=long_description,
     long_description_content_type="text/markdown",
@@ -15,6 +17,9 @@ setup(
     install_requires=[
         "requests>=2.32.0",
     ],
+    extras_require={
+        "fast": ["orjson"],
+    },
     entry_points={
         "console_scripts": [
             "youtube-music-control=youtube_music_control.__main__:main",
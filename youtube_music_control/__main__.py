@@ -1,17 +1,175 @@
-import argparse
-import json
+import os
+import sys
 
-import requests
+from youtube_music_control import __version__
+
+# Imported on first use by load_orjson(), None if it is not installed
+_orjson = False
+
+DEFAULT_SERVER = "http://localhost:26538"
+DEFAULT_API = "/api/v1"
+DEFAULT_USER = "youtube-music-control"
+DATA_METHODS = frozenset(("POST", "PATCH"))
+
+# HTTP methods implied by (--delete, --patch, data given)
+FLAG_METHODS = {
+    (True, False, False): "DELETE",
+    (True, False, True): "DELETE",
+    (False, True, False): "PATCH",
+    (False, True, True): "PATCH",
+    (False, False, True): "POST",
+}
+
+JSON_START = frozenset('{["-0123456789')
+JSON_LITERALS = frozenset(("true", "false", "null"))
+
+
+def load_orjson():
+    global _orjson
+
+    if _orjson is False:
+        try:
+            import orjson
+        except ImportError:
+            orjson = None
+
+        _orjson = orjson
+
+    return _orjson
+
+
+def json_loads(data):
+    orjson = load_orjson()
+
+    if orjson is not None:
+        return orjson.loads(data)
+
+    import json
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    orjson = load_orjson()
+
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+
+    import json
+    return json.dumps(obj)
+
+
+def print_json(obj):
+    orjson = load_orjson()
+
+    if orjson is not None:
+        data = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    else:
+        import json
+        data = json.dumps(obj, indent=2).encode()
+
+    # Flush pending print() output so the bytes land after it
+    sys.stdout.flush()
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.write(b"\n")
+
+
+def cache_path(name):
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+                                os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "youtube-music-control", name)
+
+
+def read_cache(name):
+    try:
+        with open(cache_path(name), encoding="utf-8") as f:
+            return f.read()
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(name, text):
+    path = cache_path(name)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+
+        os.replace(temp_path, path)
+    except (OSError, ValueError):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def remove_cache(name):
+    try:
+        os.remove(cache_path(name))
+    except OSError:
+        pass
 
 
 class API:
-    def __init__(self, server, api):
+    def __init__(self, server, api, user):
         self.server = server.rstrip("/")
         self.api = api.rstrip("/")
+        self.user = user
+        self.doc_cache_key = f"{self.server}{self.api}"
 
-    def authenticate(self, username, verbose=False):
-        url = f"{self.server}/auth/{username}"
-        response = requests.post(url)
+        # Imported here so that --help and argument errors stay fast
+        import hashlib
+        import requests
+
+        # Tokens are only valid for the server that issued them
+        token_key = f"{self.server}|{user}".encode()
+        self.token_cache = f"token-{hashlib.sha256(token_key).hexdigest()}"
+
+        self.session = requests.Session()
+        self._doc_cache = None
+        self._doc_from_disk = False
+        self._doc_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def authenticate(self, verbose=False, refresh=False):
+        if refresh:
+            self.session.headers.pop("Authorization", None)
+
+        return self.authorize(self.fetch_token(verbose, refresh))
+
+    def authorize(self, token):
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+        return token
+
+    def fetch_token(self, verbose=False, refresh=False):
+        if refresh:
+            remove_cache(self.token_cache)
+        else:
+            token = read_cache(self.token_cache)
+
+            if token:
+                return token
+
+        return self.read_token_response(self.request_token(), verbose)
+
+    def request_token(self):
+        return self.session.post(f"{self.server}/auth/{self.user}")
+
+    def read_token_response(self, response, verbose=False):
+        url = f"{self.server}/auth/{self.user}"
 
         if response.status_code != 200:
             print(f"Request failed: {response.status_code} {response.reason}")
@@ -21,11 +179,61 @@ class API:
         if verbose:
             print(f"POST {url} {response.status_code}")
 
-        return response.json().get("accessToken")
+        token = json_loads(response.content).get("accessToken")
+
+        if token:
+            write_cache(self.token_cache, token)
+
+        return token
+
+    def authenticate_and_fetch_api_doc(self, verbose=False, refresh=False):
+        endpoints = None if refresh else self.load_cached_endpoints()
+
+        if endpoints is not None:
+            return self.authenticate(verbose), endpoints
+
+        token = read_cache(self.token_cache)
+
+        if token:
+            endpoints = self.fetch_api_doc(verbose, refresh=refresh)
+            return self.authorize(token), endpoints
+
+        # /auth and /doc do not depend on each other, so overlap them. The
+        # worker thread only sends the request: the shared session is not
+        # modified and all output is printed here, after /doc, so that it
+        # keeps a fixed order. The token is bound once both are done.
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.request_token)
+            endpoints = self.fetch_api_doc(verbose, refresh=refresh)
+            token = self.read_token_response(future.result(), verbose)
+            return self.authorize(token), endpoints
+
+    def fetch_api_doc(self, verbose=False, print_data=False, refresh=False):
+        if not print_data and not refresh:
+            endpoints = self.load_cached_endpoints()
+
+            if endpoints is not None:
+                return endpoints
 
-    def fetch_api_doc(self, verbose=False, print_data=False):
         url = f"{self.server}/doc"
-        response = requests.get(url)
+        doc_cache = self.load_doc_cache()
+        cached = None if print_data else self.cached_doc_entry(doc_cache)
+        headers = {}
+
+        if cached is not None and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+
+        response = self.session.get(url, headers=headers)
+
+        if response.status_code == 304 and cached is not None:
+            if verbose:
+                print(f"GET {url} {response.status_code}")
+
+            self._doc_cache = cached["endpoints"]
+            self._doc_from_disk = False
+            return self._doc_cache
 
         if response.status_code != 200:
             print(f"Request failed: {response.status_code} {response.reason}")
@@ -35,45 +243,114 @@ class API:
         if verbose:
             print(f"GET {url} {response.status_code}")
 
-        if print_data:
-            if response.status_code == 200 and response.text.strip():
-                try:
-                    data = response.json()
-                    print(json.dumps(data, indent=2))
-                except Exception:
-                    print(response.text)
+        raw = response.content
+
+        try:
+            api_doc = json_loads(raw)
+        except ValueError:
+            api_doc = None
+
+        if print_data and raw.strip():
+            if api_doc is None:
+                print(response.text)
+            else:
+                print_json(api_doc)
+
+        if not isinstance(api_doc, dict):
+            print("Invalid API documentation")
+            print(url)
+            return {}
+
+        endpoints = self.parse_api_doc(api_doc)
+        doc_cache[self.doc_cache_key] = {
+            "etag": response.headers.get("ETag"),
+            "endpoints": endpoints,
+        }
+        write_cache("doc.json", json_dumps(doc_cache))
 
-        api_doc = response.json()
+        self._doc_cache = endpoints
+        self._doc_from_disk = False
+        return endpoints
+
+    def load_cached_endpoints(self):
+        if self._doc_cache is None:
+            cached = self.cached_doc_entry(self.load_doc_cache())
+
+            if cached is not None:
+                self._doc_cache = cached["endpoints"]
+                self._doc_from_disk = True
+
+        return self._doc_cache
+
+    def cached_doc_entry(self, doc_cache):
+        cached = doc_cache.get(self.doc_cache_key)
+
+        # Anything else is left over from a damaged or foreign cache file
+        if not isinstance(cached, dict):
+            return None
+
+        if not isinstance(cached.get("endpoints"), dict):
+            return None
+
+        return cached
+
+    def forget_api_doc(self):
+        self._doc_cache = None
+        self._doc_from_disk = False
+        doc_cache = self.load_doc_cache()
+
+        if doc_cache.pop(self.doc_cache_key, None) is not None:
+            write_cache("doc.json", json_dumps(doc_cache))
+
+    def load_doc_cache(self):
+        # Read doc.json at most once per run, a miss included
+        if self._doc_file is None:
+            self._doc_file = self.read_doc_cache()
+
+        return self._doc_file
+
+    def read_doc_cache(self):
+        text = read_cache("doc.json")
+
+        if text is None:
+            return {}
+
+        try:
+            doc_cache = json_loads(text)
+        except ValueError:
+            return {}
+
+        return doc_cache if isinstance(doc_cache, dict) else {}
+
+    def parse_api_doc(self, api_doc):
         endpoints = {}
         paths = api_doc.get("paths", {})
+        prefix = self.api
+        prefix_len = len(prefix)
 
         for path, methods in paths.items():
-            if not path.startswith(self.api):
-                continue
-
-            if path.endswith("-info"):
+            if not path.startswith(prefix) or path.endswith("-info"):
                 continue
 
-            endpoint = path[len(self.api):].lstrip("/")
-
-            if endpoint not in endpoints:
-                endpoints[endpoint] = {}
+            endpoint = path[prefix_len:].lstrip("/")
+            endpoint_methods = endpoints.setdefault(endpoint, {})
 
             for method, details in methods.items():
                 method = method.upper()
-                description = details.get("description", endpoint)
+                get = details.get
+                description = get("description", endpoint)
+                req_body = get("requestBody")
                 data = None
                 schema = None
 
-                if method in {"POST", "PATCH"} and "requestBody" in details:
-                    req_body = details["requestBody"]
+                if method in DATA_METHODS and req_body is not None:
                     data = req_body.get("description", "no description")
                     content = req_body.get("content", {})
 
                     if "application/json" in content:
                         schema = content["application/json"].get("schema", {})
 
-                endpoints[endpoint][method] = {
+                endpoint_methods[method] = {
                     "description": description,
                     "data": data,
                     "schema": schema,
@@ -81,35 +358,50 @@ class API:
 
         return endpoints
 
-    def make_request(self, token, endpoint, http_method,
-                     verbose=False, post_data=None):
+    def make_request(self, endpoint, http_method,
+                     verbose=False, post_data=None, method_from_doc=False):
         url = f"{self.server}{self.api}/{endpoint}"
-        headers = {"Authorization": f"Bearer {token}"}
 
         if verbose:
-            if http_method in ("POST", "PATCH") and post_data is not None:
+            if http_method in DATA_METHODS and post_data is not None:
                 try:
-                    print(json.dumps(post_data, indent=2))
+                    print_json(post_data)
                 except Exception:
                     print(post_data)
 
-        response = requests.request(
-            http_method,
-            url,
-            headers=headers,
-            json=post_data,
-        )
+        response = self.session.request(http_method, url, json=post_data)
+
+        if response.status_code == 401:
+            if self.authenticate(verbose, refresh=True) is None:
+                return
+
+            response = self.session.request(http_method, url, json=post_data)
+
+        doc_from_disk = self._doc_from_disk
+
+        # A listed endpoint that is gone means the cached table is out of
+        # date. A fresh table, an unlisted endpoint or a method chosen by a
+        # flag or data tells nothing about the table.
+        if (response.status_code == 404 and doc_from_disk and method_from_doc
+                and endpoint in self._doc_cache):
+            self.forget_api_doc()
 
         if not response.ok:
             print(f"Request failed: {response.status_code} {response.reason}")
             print(url)
+
+            if response.status_code == 404 and doc_from_disk:
+                print("The endpoint list is cached,"
+                      " use --refresh-doc to update it")
+
             return
 
         parsed_data = None
+        raw = response.content
 
-        if response.text.strip():
+        if raw.strip():
             try:
-                parsed_data = response.json()
+                parsed_data = json_loads(raw)
             except ValueError:
                 parsed_data = response.text.strip()
 
@@ -118,21 +410,23 @@ class API:
 
         if parsed_data:
             if isinstance(parsed_data, dict):
-                print(json.dumps(parsed_data, indent=2))
+                print_json(parsed_data)
             else:
                 print(parsed_data)
 
 
 def parse_arguments():
+    import argparse
+
     parser = argparse.ArgumentParser(
         description="Remote control client for th-ch/youtube-music",
     )
 
-    parser.add_argument("--server", "-s", default="http://localhost:26538",
+    parser.add_argument("--server", "-s", default=DEFAULT_SERVER,
                         help="Server base URL (default: %(default)s)")
-    parser.add_argument("--api", default="/api/v1",
+    parser.add_argument("--api", default=DEFAULT_API,
                         help="API path (default: %(default)s)")
-    parser.add_argument("--user", "-u", default="youtube-music-control",
+    parser.add_argument("--user", "-u", default=DEFAULT_USER,
                         help="Username for authentication"
                              " (default: %(default)s)")
     parser.add_argument("--patch", action="store_true",
@@ -141,8 +435,13 @@ def parse_arguments():
                         help="Use DELETE method")
     parser.add_argument("--list", "-l", action="store_true",
                         help="List available API endpoints")
+    parser.add_argument("--refresh-doc", action="store_true",
+                        help="Fetch the API documentation instead of using"
+                             " the cached copy")
     parser.add_argument("--verbose", "-v", action="store_true",
                         help="Print request details")
+    parser.add_argument("--version", "-V", action="version",
+                        version=f"%(prog)s {__version__}")
     parser.add_argument("endpoint", nargs="?",
                         help="API endpoint to call")
     parser.add_argument("data", nargs="?",
@@ -158,6 +457,31 @@ def parse_arguments():
     return parser, args
 
 
+def parse_positional_arguments(argv):
+    # Plain "<endpoint> [data]" calls, as used from key bindings, do not
+    # need the full argument parser
+    if not 1 <= len(argv) <= 2 or not argv[0]:
+        return None
+
+    if any(arg.startswith("-") for arg in argv):
+        return None
+
+    from types import SimpleNamespace
+
+    return SimpleNamespace(
+        server=DEFAULT_SERVER,
+        api=DEFAULT_API,
+        user=DEFAULT_USER,
+        patch=False,
+        delete=False,
+        list=False,
+        refresh_doc=False,
+        verbose=False,
+        endpoint=argv[0],
+        data=argv[1] if len(argv) > 1 else None,
+    )
+
+
 def display_endpoints(endpoints):
     if not endpoints:
         print("No endpoints found!")
@@ -176,45 +500,92 @@ def display_endpoints(endpoints):
             else:
                 line += f"\n    {method}: {description}"
 
-            if method in ("POST", "PATCH") and data_info:
+            if method in DATA_METHODS and data_info:
                 line += f" (data: {data_info})"
 
         print(line)
 
 
+def flag_http_method(args):
+    return FLAG_METHODS.get((args.delete, args.patch, args.data is not None))
+
+
 def determine_http_method(args, endpoints):
-    if args.delete:
-        return "DELETE"
+    method = flag_http_method(args)
 
-    if args.patch:
-        return "PATCH"
+    if method is not None:
+        return method
 
-    if args.data is not None:
-        return "POST"
+    methods = endpoints.get(args.endpoint)
 
-    if args.endpoint not in endpoints:
+    if not methods or "GET" in methods:
         return "GET"
 
-    methods = endpoints[args.endpoint]
+    return next(iter(methods))
 
-    if "GET" in methods:
-        return "GET"
 
-    return list(methods.keys())[0]
+def load_data(data):
+    if data is None:
+        return None
+
+    # Plain words such as "next" cannot be JSON, so skip the parser for them
+    text = data.lstrip()
+
+    if not text or (text[0] not in JSON_START
+                     and text.rstrip() not in JSON_LITERALS):
+        return data
+
+    try:
+        return json_loads(data)
+    except ValueError:
+        return data
+
+
+def needs_api_doc(args, loaded):
+    method = flag_http_method(args)
+
+    # Without data or a method flag the doc decides between GET and POST
+    if method is None:
+        return True
+
+    if method not in DATA_METHODS or args.data is None:
+        return False
+
+    # Single values are wrapped in an object using the endpoint's schema
+    return not isinstance(loaded, dict)
+
+
+def to_number(value):
+    if isinstance(value, str):
+        text = value.strip()
+        digits = text[1:] if text[:1] in ("+", "-") else text
+
+        if digits.isdecimal():
+            try:
+                return int(text)
+            except ValueError:
+                # Longer than the interpreter's int conversion limit
+                return value
+
+        # Other strings need a fraction, an exponent or digit separators
+        if not any(char in text for char in "._eE"):
+            return value
+
+    try:
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        return value
+
+    return int(number) if number.is_integer() else number
 
 
-def process_post_data(http_method, args, endpoints):
-    if http_method not in ("POST", "PATCH"):
+def process_post_data(http_method, args, loaded, endpoints):
+    if http_method not in DATA_METHODS:
         return None
 
     if args.data is None:
         return None
 
-    try:
-        loaded = json.loads(args.data)
-    except json.JSONDecodeError:
-        loaded = args.data
-
     if isinstance(loaded, dict):
         return loaded
 
@@ -238,46 +609,60 @@ def process_post_data(http_method, args, endpoints):
     key = required[0]
 
     if properties.get(key, {}).get("type") == "number":
-        try:
-            value = float(loaded)
-
-            if value.is_integer():
-                value = int(value)
-
-            loaded = value
-        except Exception:
-            pass
+        loaded = to_number(loaded)
 
     return {key: loaded}
 
 
 def main():
-    parser, args = parse_arguments()
-    api = API(args.server, args.api)
-
-    if args.list:
-        endpoints = api.fetch_api_doc(args.verbose, print_data=args.verbose)
-        display_endpoints(endpoints)
+    # Answer --version without building the argument parser
+    if sys.argv[1:] in (["--version"], ["-V"]):
+        print(f"{os.path.basename(sys.argv[0])} {__version__}")
         return
 
-    if not args.endpoint:
-        parser.print_help()
-        return
+    args = parse_positional_arguments(sys.argv[1:])
 
-    endpoints = api.fetch_api_doc(args.verbose, print_data=False)
-    http_method = determine_http_method(args, endpoints)
-    post_data = process_post_data(http_method, args, endpoints)
+    if args is None:
+        parser, args = parse_arguments()
 
-    token = api.authenticate(args.user, args.verbose)
+        if not args.list and not args.endpoint and not args.refresh_doc:
+            parser.print_help()
+            return
 
-    if token:
-        api.make_request(
-            token,
-            args.endpoint,
-            http_method,
-            verbose=args.verbose,
-            post_data=post_data
-        )
+    with API(args.server, args.api, args.user) as api:
+        if args.list:
+            endpoints = api.fetch_api_doc(args.verbose,
+                                          print_data=args.verbose,
+                                          refresh=True)
+            display_endpoints(endpoints)
+            return
+
+        if not args.endpoint:
+            api.fetch_api_doc(args.verbose, refresh=True)
+            return
+
+        loaded = load_data(args.data)
+
+        if args.refresh_doc or needs_api_doc(args, loaded):
+            token, endpoints = api.authenticate_and_fetch_api_doc(
+                args.verbose,
+                refresh=args.refresh_doc,
+            )
+        else:
+            token = api.authenticate(args.verbose)
+            endpoints = {}
+
+        http_method = determine_http_method(args, endpoints)
+        post_data = process_post_data(http_method, args, loaded, endpoints)
+
+        if token:
+            api.make_request(
+                args.endpoint,
+                http_method,
+                verbose=args.verbose,
+                post_data=post_data,
+                method_from_doc=flag_http_method(args) is None,
+            )
 
 
 if __name__ == "__main__":